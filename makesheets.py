@@ -7,7 +7,8 @@ import zipfile
 
 # LOCAL MODULE IMPORTS --------------------------------------------------------
 
-from moodlesheet import (extract_images,
+from moodlesheet import (Decoder,
+                         extract_images,
                          extract_pdfs,
                          extract_tiles,
                          sanitize)
@@ -43,6 +44,20 @@ if __name__ == "__main__":
     mpmax = 32
     quality = 95
     optimize = True
+    # maximum file size of a sheet in bytes, e.g. 2 * 1024 * 1024 (or None)
+    max_bytes = None
+    # images above this size in megapixels or taking longer than this many
+    # seconds to decode are replaced by the placeholder (or None)
+    decode_mpmax = 100
+    decode_timeout = 30
+    # store a tile atlas next to every sheet for quick re-layouts
+    use_atlas = False
+    # smaller versions of every sheet as (suffix, mpmax, quality), derived
+    # from the same layout, e.g. [("_web", 2, 85), ("_thumb", 0.1, 80)]
+    variants = []
+
+    # one pool of decoding workers is shared by all sheets
+    decoder = Decoder() if decode_timeout else None
 
     # PORTFOLIO CONTACT SHEETS ------------------------------------------------
 
@@ -73,6 +88,11 @@ if __name__ == "__main__":
     for p in portfolios:
         fn = os.path.basename(os.path.normpath(p)) + ".jpg"
         outfile = os.path.join(OUTPUT_DIR, fn)
+        atlas = outfile[:-4] + "_atlas" if use_atlas else None
+        outvariants = [{"outputfile": outfile[:-4] + suffix + ".jpg",
+                        "mpmax": vmpmax,
+                        "quality": vquality}
+                       for suffix, vmpmax, vquality in variants]
 
         extract_images(p, outfile, PLACEHOLDER,
                        mode=mode,
@@ -82,7 +102,13 @@ if __name__ == "__main__":
                        background=background,
                        mpmax=mpmax,
                        quality=quality,
-                       optimize=optimize)
+                       optimize=optimize,
+                       max_bytes=max_bytes,
+                       decode_mpmax=decode_mpmax,
+                       decode_timeout=decode_timeout,
+                       decoder=decoder,
+                       atlas=atlas,
+                       variants=outvariants)
 
     # PDF CONTACT SHEET -------------------------------------------------------
 
@@ -113,6 +139,11 @@ if __name__ == "__main__":
     for p in pdf_maindirs:
         fn = os.path.basename(os.path.normpath(p)) + ".jpg"
         outfile = os.path.join(OUTPUT_DIR, fn)
+        atlas = outfile[:-4] + "_atlas" if use_atlas else None
+        outvariants = [{"outputfile": outfile[:-4] + suffix + ".jpg",
+                        "mpmax": vmpmax,
+                        "quality": vquality}
+                       for suffix, vmpmax, vquality in variants]
 
         extract_pdfs(p, outfile, PLACEHOLDER,
                      mode=mode,
@@ -122,7 +153,12 @@ if __name__ == "__main__":
                      background=background,
                      mpmax=mpmax,
                      quality=quality,
-                     optimize=optimize)
+                     optimize=optimize,
+                     max_bytes=max_bytes,
+                     decode_mpmax=decode_mpmax,
+                     decode_timeout=decode_timeout,
+                     atlas=atlas,
+                     variants=outvariants)
 
     # PORTFOLIO TILES CONTACT SHEETS -----------------------------------------
 
@@ -153,6 +189,11 @@ if __name__ == "__main__":
     for p in portfolios:
         fn = os.path.basename(os.path.normpath(p)) + ".jpg"
         outfile = os.path.join(OUTPUT_DIR, fn)
+        atlas = outfile[:-4] + "_atlas" if use_atlas else None
+        outvariants = [{"outputfile": outfile[:-4] + suffix + ".jpg",
+                        "mpmax": vmpmax,
+                        "quality": vquality}
+                       for suffix, vmpmax, vquality in variants]
 
         extract_tiles(p, outfile, PLACEHOLDER,
                       mode=mode,
@@ -162,4 +203,13 @@ if __name__ == "__main__":
                       background=background,
                       mpmax=mpmax,
                       quality=quality,
-                      optimize=optimize)
+                      optimize=optimize,
+                      max_bytes=max_bytes,
+                      decode_mpmax=decode_mpmax,
+                      decode_timeout=decode_timeout,
+                      decoder=decoder,
+                      atlas=atlas,
+                      variants=outvariants)
+
+    if decoder is not None:
+        decoder.close()
@@ -69,5 +69,9 @@ setup(
     keywords=keywords_list,
     install_requires=requirements,
     extras_require={},
-    entry_points={},
+    entry_points={
+        "console_scripts": [
+            "moodlesheet-server = moodlesheet.server:main",
+        ],
+    },
 )
@@ -12,12 +12,26 @@ from .__version__ import (__author__, __author_email__, __copyright__,
 from moodlesheet.extract import (extract_images,
                                  extract_pdfs,
                                  extract_tiles,
+                                 relayout,
                                  sanitize)
 
+from moodlesheet.guard import Decoder
+
+from moodlesheet.memory import (Export,
+                                render_images,
+                                render_pdfs,
+                                render_tiles)
+
 __all__ = [
+    "Decoder",
+    "Export",
     "extract_images",
     "extract_pdfs",
     "extract_tiles",
+    "relayout",
+    "render_images",
+    "render_pdfs",
+    "render_tiles",
     "sanitize",
     "__author__", "__author_email__", "__copyright__", "__description__",
     "__license__", "__title__", "__url__", "__version__",
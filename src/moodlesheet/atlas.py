@@ -0,0 +1,115 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import json
+import mmap
+import os
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet.layout import compose_sheet, get_max_bounds, plan_sheet
+
+
+# CONSTANTS -------------------------------------------------------------------
+
+TILES_FILE = "tiles.bin"
+"""str: Name of the file containing the raw RGBX pixels of all tiles."""
+
+MANIFEST_FILE = "manifest.json"
+"""str: Name of the file describing the placement of every tile."""
+
+TILE_MODE = "RGBX"
+"""str: Pixel layout of the tiles, one PIL can map without copying."""
+
+
+# FUNCTION DEFINITIONS---------------------------------------------------------
+
+def get_tile_bounds(entry_sizes, factor=1, mpmax=30):
+    """
+    Returns the size every image has to be stored at in the atlas, the
+    largest bound any layout mode can produce for it.
+    """
+    return get_max_bounds(entry_sizes, factor=factor, mpmax=mpmax)
+
+
+def write_atlas(entries, sizes, atlasdir, factor=1, mpmax=30):
+    """
+    Writes the images of every entry, already resized to the bounds of
+    `get_tile_bounds`, into a tile atlas in `atlasdir`. The atlas consists
+    of a single file of raw RGBX pixels and a JSON manifest of the entries,
+    holding the original size and location of every tile.
+    """
+    os.makedirs(atlasdir, exist_ok=True)
+    manifest = {"factor": factor, "mpmax": mpmax, "entries": []}
+    offset = 0
+    with open(os.path.join(atlasdir, TILES_FILE), "wb") as f:
+        for images, entry_sizes in zip(entries, sizes):
+            tiles = []
+            for image, size in zip(images, entry_sizes):
+                data = image.convert(TILE_MODE).tobytes()
+                f.write(data)
+                tiles.append({"offset": offset,
+                              "width": image.width,
+                              "height": image.height,
+                              "size": list(size)})
+                offset += len(data)
+            manifest["entries"].append(tiles)
+    with open(os.path.join(atlasdir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+    return atlasdir
+
+
+def read_manifest(atlasdir):
+    """
+    Returns the manifest of the tile atlas in `atlasdir`.
+    """
+    with open(os.path.join(atlasdir, MANIFEST_FILE), "r") as f:
+        return json.load(f)
+
+
+def compose_atlas(atlasdir, mode="floor", factor=1, wm=0, hm=0, center=True,
+                  background="white", mpmax=30):
+    """
+    Creates a tiled image from the tile atlas in `atlasdir` without decoding
+    any of the original images. Entries of several images are combined
+    anew with the given layout. The tiles are memory-mapped and never
+    upscaled, so layouts asking for larger tiles than the atlas was written
+    for will leave them smaller than the grid cells.
+    """
+    manifest = read_manifest(atlasdir)
+    entry_sizes = [[tuple(t["size"]) for t in tiles]
+                   for tiles in manifest["entries"]]
+    plan = plan_sheet(entry_sizes,
+                      mode=mode,
+                      factor=factor,
+                      wm=wm,
+                      hm=hm,
+                      mpmax=mpmax)
+    if not any(entry_sizes):
+        return compose_sheet(plan, [[] for _ in entry_sizes],
+                             center=center, background=background)
+    with open(os.path.join(atlasdir, TILES_FILE), "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        entries = []
+        for tiles in manifest["entries"]:
+            images = []
+            for t in tiles:
+                size = (t["width"], t["height"])
+                end = t["offset"] + size[0] * size[1] * 4
+                # RGBX rows are mapped as they are, without copying
+                images.append(Image.frombuffer(TILE_MODE, size,
+                                               view[t["offset"]:end],
+                                               "raw", TILE_MODE, 0, 1))
+            entries.append(images)
+        sheet = compose_sheet(plan, entries, center=center,
+                              background=background)
+        # the mapping can only be closed once no image refers to it anymore
+        del entries, images
+        view.release()
+    return sheet
@@ -59,17 +59,7 @@ def create_tiled_image(images, mode="original",
         return Image.new("RGB", (1, 1), "black")
     grid_size = get_grid_size(image_count)
     sizes = _get_image_sizes(images)
-    if mode == "average":
-        # takes average image size in collection as tile size
-        image_size = (int(math.floor(mean([s[0] for s in sizes]))),
-                      int(math.floor(mean([s[1] for s in sizes]))))
-    elif mode == "floor":
-        # takes smallest image size in collection as tile size
-        image_size = (int(math.floor(min([s[0] for s in sizes]))),
-                      int(math.floor(min([s[1] for s in sizes]))))
-    else:
-        # takes first image size in collection as tile size
-        image_size = sizes[0]
+    image_size = get_image_size(sizes, mode=mode)
     # ocmpute tile size and final size
     tile_size, output_size = get_tiled_image_dimensions(grid_size,
                                                         image_size,
@@ -92,6 +82,26 @@ def create_tiled_image(images, mode="original",
     return final_image
 
 
+def get_image_size(sizes, mode="original"):
+    """
+    Returns the image size the tiles are based on for the given mode.
+    "average" takes the average and "floor" the smallest image size in the
+    collection, any other mode takes the size of the first image.
+    >>> get_image_size([(400, 300), (200, 100)], mode="floor")
+    (200, 100)
+    """
+    if mode == "average":
+        # takes average image size in collection as tile size
+        return (int(math.floor(mean([s[0] for s in sizes]))),
+                int(math.floor(mean([s[1] for s in sizes]))))
+    elif mode == "floor":
+        # takes smallest image size in collection as tile size
+        return (int(math.floor(min([s[0] for s in sizes]))),
+                int(math.floor(min([s[1] for s in sizes]))))
+    # takes first image size in collection as tile size
+    return tuple(sizes[0])
+
+
 def get_grid_size(cell_count):
     """
     Determines the best grid shape for a given cell count.
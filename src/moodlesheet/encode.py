@@ -0,0 +1,163 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import io
+import math
+import os
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+
+
+# CONSTANTS -------------------------------------------------------------------
+
+PROXY_PIXELS = 1000000
+"""int: Maximum pixel count of the proxy used for trial encodes."""
+
+PROXY_BLOCKS = 8
+"""int: Number of sampled blocks per row and column of the proxy."""
+
+MIN_QUALITY = 20
+"""int: Lowest quality the size search will use before downscaling."""
+
+MIN_BYTES = 2048
+"""int: Smallest byte budget accepted, below it headers alone won't fit."""
+
+MIN_SIDE = 16
+"""int: Smallest longer side in pixels the size search will downscale to."""
+
+QUALITY_FORMATS = ("JPEG", "WEBP")
+"""tuple: Formats where the quality setting influences the file size."""
+
+
+# FUNCTION DEFINITIONS---------------------------------------------------------
+
+def get_format(outputfile, default="JPEG"):
+    """
+    Returns the PIL format name for the extension of the output file.
+    """
+    ext = os.path.splitext(str(outputfile))[1].lower()
+    return Image.registered_extensions().get(ext, default)
+
+
+def _encode(image, fmt, quality, optimize, scale=1.0):
+    """
+    Encodes the image, optionally downscaled by `scale`, and returns the
+    resulting bytes.
+    """
+    if scale < 1.0:
+        image = image.resize((max(1, int(image.width * scale)),
+                              max(1, int(image.height * scale))),
+                             Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=quality, optimize=optimize)
+    return buffer.getvalue()
+
+
+def get_proxy(image):
+    """
+    Returns a proxy for trial encodes of a large image, assembled from
+    evenly spaced full resolution blocks. Unlike a resized copy, this keeps
+    the detail per pixel and therefore the bytes per pixel of the original.
+    """
+    if image.width * image.height <= PROXY_PIXELS:
+        return image
+    # block sides are multiples of 16 to align with the JPEG MCUs
+    side = int(math.sqrt(PROXY_PIXELS) / PROXY_BLOCKS) // 16 * 16
+    bw = min(side, image.width // PROXY_BLOCKS // 16 * 16 or image.width)
+    bh = min(side, image.height // PROXY_BLOCKS // 16 * 16 or image.height)
+    proxy = Image.new(image.mode, (bw * PROXY_BLOCKS, bh * PROXY_BLOCKS))
+    for i in range(PROXY_BLOCKS):
+        for j in range(PROXY_BLOCKS):
+            x = (image.width - bw) * i // max(1, PROXY_BLOCKS - 1)
+            y = (image.height - bh) * j // max(1, PROXY_BLOCKS - 1)
+            proxy.paste(image.crop((x, y, x + bw, y + bh)), (i * bw, j * bh))
+    return proxy
+
+
+def encode_image(image, fmt="JPEG", quality=100, optimize=True):
+    """
+    Encodes the image and returns the resulting bytes.
+    """
+    return _encode(image.convert("RGB"), fmt, quality, optimize)
+
+
+def encode_to_size(image, max_bytes, fmt="JPEG", quality=100,
+                   optimize=True):
+    """
+    Encodes the image within a budget of `max_bytes` and returns a tuple of
+    (bytes, quality, scale).
+
+    Quality (and, if needed, scale) are searched using trial encodes of a
+    proxy, so that the budget is usually met with one or two full encodes.
+    Raises a ValueError if the budget is below `MIN_BYTES` or can't be met
+    without shrinking the image below `MIN_SIDE` pixels.
+    """
+    if max_bytes < MIN_BYTES:
+        raise ValueError("A budget of {0} bytes is below the minimum of {1} "
+                         "bytes!".format(max_bytes, MIN_BYTES))
+    image = image.convert("RGB")
+    proxy = get_proxy(image)
+    ratio = (image.width * image.height) / (proxy.width * proxy.height)
+    min_quality = min(MIN_QUALITY if fmt in QUALITY_FORMATS else quality,
+                      quality)
+    trials = {}
+    # size model: proxy size * ratio * correction * scale ** exponent
+    model = {"correction": 1.0, "exponent": 2.0}
+
+    def predict(q, scale=1.0):
+        if q not in trials:
+            trials[q] = len(_encode(proxy, fmt, q, False))
+        return (trials[q] * ratio * model["correction"] *
+                scale ** model["exponent"])
+
+    def search(budget):
+        # binary search the highest quality predicted to fit the budget
+        if predict(min_quality) > budget:
+            scale = (budget / predict(min_quality)) ** (
+                                                1.0 / model["exponent"])
+            return min_quality, min(1.0, scale)
+        lo, hi = min_quality, quality
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if predict(mid) <= budget:
+                lo = mid
+            else:
+                hi = mid - 1
+        return lo, 1.0
+
+    def calibrate(q, scale, size):
+        # fit the correction at full scale, the exponent when downscaled
+        if scale < 1.0:
+            model["exponent"] = max(0.5, math.log(size / predict(q)) /
+                                    math.log(scale))
+        else:
+            model["correction"] *= size / predict(q)
+
+    # first full encode with the uncalibrated prediction
+    q, scale = search(max_bytes)
+    data = _encode(image, fmt, q, optimize, scale)
+    best = (data, q, scale) if len(data) <= max_bytes else None
+    # calibrate and do a second full encode if the first one missed the
+    # budget or left a lot of it unused
+    if best is None or (len(data) < 0.85 * max_bytes and
+                        (q, scale) != (quality, 1.0)):
+        calibrate(q, scale, len(data))
+        q2, scale2 = search(max_bytes * 0.97)
+        if (q2, scale2) != (q, scale):
+            q, scale = q2, scale2
+            data = _encode(image, fmt, q, optimize, scale)
+            if len(data) <= max_bytes and (best is None or
+                                           len(data) > len(best[0])):
+                best = (data, q, scale)
+    # shrink the scale directly if the calibrated model still missed
+    while best is None:
+        scale *= min(0.9, math.sqrt(max_bytes / len(data)))
+        if max(image.width, image.height) * scale < MIN_SIDE:
+            raise ValueError("Image can't be encoded within {0} "
+                             "bytes!".format(max_bytes))
+        data = _encode(image, fmt, q, optimize, scale)
+        if len(data) <= max_bytes:
+            best = (data, q, scale)
+    return best
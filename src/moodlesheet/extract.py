@@ -3,20 +3,26 @@
 import glob
 import math
 import os
-import shutil
+import re
+import subprocess
 import sys
+import tempfile
 
 
 # THIRD PARTY MODULE IMPORTS --------------------------------------------------
 
 import bs4
 import pdf2image
-from pdf2image.exceptions import PDFPageCountError
+from pdf2image.exceptions import PDFPageCountError, PDFPopplerTimeoutError
+from PIL import Image
 
 
 # LOCAL MODULE IMPORTS --------------------------------------------------------
 
-from moodlesheet.contactsheet import contactsheet
+from moodlesheet.atlas import compose_atlas, get_tile_bounds, write_atlas
+from moodlesheet.encode import encode_image, encode_to_size, get_format
+from moodlesheet.guard import DECODE_MPMAX, decode_images, read_size
+from moodlesheet.layout import compose_sheet, fit_image, plan_sheet
 
 
 # LOGGING ---------------------------------------------------------------------
@@ -50,6 +56,12 @@ class Log(object):
 log = Log()
 
 
+# CONSTANTS -------------------------------------------------------------------
+
+PDF_DPI = 200
+"""int: Resolution the first page of every PDF is converted at."""
+
+
 # FUNCTION DEFINITIONS---------------------------------------------------------
 
 def sanitize(path):
@@ -77,12 +89,321 @@ def verify_img(filepath, placeholder):
     return placeholder
 
 
+def is_trusted(image, placeholder):
+    """
+    Returns True for images that are decoded already or are the placeholder,
+    which never need to be guarded.
+    """
+    return isinstance(image, Image.Image) or image == placeholder
+
+
+def _read_header(image, opener=None, mpmax=DECODE_MPMAX):
+    """
+    Returns the result of `read_size` for an image path or, if an `opener`
+    is given, for the file object it opens for the image name.
+    """
+    if opener is None:
+        return read_size(image, mpmax=mpmax)
+    with opener(image) as f:
+        return read_size(f, mpmax=mpmax)
+
+
+def _read_source(image, opener=None):
+    """
+    Returns an image path as it is or, if an `opener` is given, the bytes of
+    the file it opens for the image name.
+    """
+    if opener is None:
+        return image
+    with opener(image) as f:
+        return f.read()
+
+
+def warn_placeholder(message, source):
+    """
+    Logs that the placeholder is inserted for an image and why.
+    """
+    log.warn(("{0} for ...{1}! Inserting placeholder...").format(
+                                                message, str(source)[-45:]))
+
+
+def parse_portfolio(html):
+    """
+    Returns the image sources of a moodle portfolio HTML file (a file object,
+    string or bytes) as one list per <div> tag.
+    """
+    # parse file using beautifulsoup
+    soup = bs4.BeautifulSoup(html, "html.parser")
+    # extract all divs from the file
+    divs = soup.find_all("div")
+    log.info("{0} entries found...".format(len(divs)))
+    return [[img["src"] for img in div.find_all("img")] for div in divs]
+
+
+def get_pdf_pixels(info, dpi=PDF_DPI):
+    """
+    Returns the number of pixels of the first page of a PDF rendered at
+    `dpi`, from the info returned by pdfinfo, or None if it is unknown.
+    """
+    match = re.match(r"\s*([\d.]+) x ([\d.]+)", info.get("Page size", ""))
+    if match is None:
+        return None
+    width, height = (float(v) / 72 * dpi for v in match.groups())
+    return width * height
+
+
+def convert_pdf(pdf, name, mpmax=DECODE_MPMAX, timeout=None):
+    """
+    Returns the first page of a PDF (a path or bytes) as an image, or None if
+    the PDF is corrupt, its first page exceeds `mpmax` megapixels or its
+    conversion exceeds `timeout` seconds. PDF bytes are written to a single
+    temporary file, as poppler reads PDFs from files.
+    """
+    if isinstance(pdf, bytes):
+        with tempfile.TemporaryDirectory() as tempdir:
+            pdfpath = os.path.join(tempdir, "document.pdf")
+            with open(pdfpath, "wb") as f:
+                f.write(pdf)
+            return convert_pdf(pdfpath, name, mpmax=mpmax, timeout=timeout)
+    try:
+        info = pdf2image.pdfinfo_from_path(pdf, timeout=timeout)
+        pixels = get_pdf_pixels(info)
+        if mpmax and pixels and pixels > mpmax * 1000000:
+            log.warn("PDF {0} has {1:.1f} MP, limit is {2} MP!".format(
+                                    name[-40:], pixels / 1000000, mpmax))
+            return None
+        # only the first page is used, so only that one is converted
+        pdfpages = pdf2image.convert_from_path(pdf,
+                                               dpi=PDF_DPI,
+                                               first_page=1,
+                                               last_page=1,
+                                               timeout=timeout)
+    except PDFPageCountError:
+        log.warn("PDF file is corrupt!")
+        return None
+    except (PDFPopplerTimeoutError, subprocess.TimeoutExpired):
+        log.warn("PDF {0} exceeded {1} s of conversion!".format(name[-40:],
+                                                                timeout))
+        return None
+    if not pdfpages:
+        log.warn("PDF {0} has no pages!".format(name[-40:]))
+        return None
+    if info.get("Pages", 1) > 1:
+        log.warn(("PDF {0} has more than one page! Only first page "
+                  "will be used!").format(name[-40:]))
+    return pdfpages[0]
+
+
+def convert_pdfs(pdfs, names, placeholder=None, mpmax=DECODE_MPMAX,
+                 timeout=None, read=None):
+    """
+    Returns the first page of every PDF (a path, bytes or a name that `read`
+    returns the bytes for) as an image. PDFs that can't be converted are
+    replaced by the placeholder, or skipped if there is none.
+    """
+    images = []
+    for i, (pdf, name) in enumerate(zip(pdfs, names)):
+        log.prog("Preprocessing PDF {0} / {1} ({2} %)".format(
+                                    i + 1,
+                                    len(pdfs),
+                                    math.floor(((i + 1) / len(pdfs)) * 100)))
+        # convert pdf to single images, reading one PDF at a time
+        image = convert_pdf(read(pdf) if read else pdf, name,
+                            mpmax=mpmax,
+                            timeout=timeout)
+        if image is not None:
+            images.append(image)
+        elif placeholder is not None:
+            log.warn("Inserting placeholder...")
+            images.append(placeholder)
+        else:
+            log.warn("Skipping...")
+    return images
+
+
+def build_sheet(entries, placeholder, atlas=None, mode="floor", factor=1,
+                wm=0, hm=0, background="white", mpmax=30,
+                decode_mpmax=DECODE_MPMAX, decode_timeout=None, decoder=None,
+                opener=None):
+    """
+    Creates the contact sheet from the images of every entry, combining
+    entries of several images into a single tile. Images are paths, image
+    objects or names that `opener` returns a binary file object for.
+
+    Only the image headers are read for the layout, then every image is
+    decoded once, straight to its tile size. Images exceeding `decode_mpmax`
+    megapixels or `decode_timeout` seconds of decoding (in the worker
+    processes of `decoder`, see `Decoder`) or failing to decode at all are
+    replaced by the placeholder. If an `atlas` directory is given, the
+    images are stored there as well, resized for later re-layouts.
+    """
+    entries = [list(images) for images in entries]
+    sizes = []
+    for images in entries:
+        sizes.append([])
+        for j, image in enumerate(images):
+            if not is_trusted(image, placeholder):
+                size, error = _read_header(image,
+                                           opener=opener,
+                                           mpmax=decode_mpmax)
+                if error is None:
+                    sizes[-1].append(size)
+                    continue
+                warn_placeholder(error, image)
+                images[j] = image = placeholder
+            if isinstance(image, Image.Image):
+                sizes[-1].append(image.size)
+            else:
+                sizes[-1].append(read_size(image, mpmax=None)[0])
+    plan = plan_sheet(sizes,
+                      mode=mode,
+                      factor=factor,
+                      wm=wm,
+                      hm=hm,
+                      mpmax=mpmax)
+    bounds = [[[bound] for bound in cell["bounds"]] for cell in plan["cells"]]
+    if atlas:
+        atlas_bounds = get_tile_bounds(sizes, factor=factor, mpmax=mpmax)
+        for entry, atlas_entry in zip(bounds, atlas_bounds):
+            for image_bounds, atlas_bound in zip(entry, atlas_entry):
+                image_bounds.append(atlas_bound)
+    # decode all images at once to make use of all workers
+    slots = [(i, j) for i, images in enumerate(entries)
+             for j, image in enumerate(images)
+             if not is_trusted(image, placeholder)]
+    log.info("Decoding {0} images...".format(len(slots)))
+    # encoded images are only read once the workers are ready for them
+    jobs = ((_read_source(entries[i][j], opener=opener), bounds[i][j])
+            for i, j in slots)
+    decoded = dict(zip(slots, decode_images(jobs,
+                                            timeout=decode_timeout,
+                                            decoder=decoder)))
+    tiles = []
+    atlas_tiles = []
+    for i, images in enumerate(entries):
+        tiles.append([])
+        atlas_tiles.append([])
+        for j, image in enumerate(images):
+            fitted, error = decoded.get((i, j), (None, None))
+            if error is not None:
+                warn_placeholder(error, image)
+                image = placeholder
+            if fitted is None:
+                fitted = fit_image(image, bounds[i][j])
+            tiles[-1].append(fitted[0])
+            atlas_tiles[-1].extend(fitted[1:])
+    sheet = compose_sheet(plan, tiles, background=background)
+    if atlas:
+        log.info("Writing tile atlas {0}...".format(atlas))
+        write_atlas(atlas_tiles, sizes, sanitize(atlas),
+                    factor=factor, mpmax=mpmax)
+    return sheet
+
+
+def encode_sheet(sheet, fmt="JPEG", quality=100, optimize=True,
+                 max_bytes=None):
+    """
+    Returns the encoded contact sheet. If `max_bytes` is given, quality and
+    scale are reduced as needed to stay within the budget.
+    """
+    if not max_bytes:
+        return encode_image(sheet, fmt=fmt, quality=quality,
+                            optimize=optimize)
+    data, quality, scale = encode_to_size(sheet,
+                                          max_bytes,
+                                          fmt=fmt,
+                                          quality=quality,
+                                          optimize=optimize)
+    log.info(("Encoded contact sheet at quality {0} and scale {1:.2f} "
+              "({2} / {3} bytes)").format(quality, scale, len(data),
+                                         max_bytes))
+    return data
+
+
+def save_sheet(sheet, outputfile, quality=100, optimize=True,
+               max_bytes=None):
+    """
+    Saves the contact sheet to the output file. If `max_bytes` is given,
+    quality and scale are reduced as needed to stay within the budget.
+    """
+    outputfile = sanitize(outputfile)
+    data = encode_sheet(sheet,
+                        fmt=get_format(outputfile),
+                        quality=quality,
+                        optimize=optimize,
+                        max_bytes=max_bytes)
+    with open(outputfile, "wb") as f:
+        f.write(data)
+    return outputfile
+
+
+def resize_to_mpmax(image, mpmax=None):
+    """
+    Returns the image downscaled so that neither side exceeds the side of a
+    square of `mpmax` megapixels, the same limit the layout applies.
+    """
+    if not mpmax:
+        return image
+    maxdim = math.floor(math.sqrt(mpmax * 1000000))
+    if max(image.size) <= maxdim:
+        return image
+    # multiply first, so that the longer side ends up at exactly maxdim
+    return image.resize((max(1, image.width * maxdim // max(image.size)),
+                         max(1, image.height * maxdim // max(image.size))),
+                        Image.LANCZOS,
+                        reducing_gap=3.0)
+
+
+def derive_variants(sheet, variants):
+    """
+    Returns one image per variant, downscaled from the sheet to the `mpmax`
+    of the variant. Every variant is derived from the next larger one, so
+    each one only needs a single small resize.
+    """
+    images = [None] * len(variants)
+    order = sorted(range(len(variants)),
+                   key=lambda i: variants[i].get("mpmax") or math.inf,
+                   reverse=True)
+    image = sheet
+    for i in order:
+        image = resize_to_mpmax(image, variants[i].get("mpmax"))
+        images[i] = image
+    return images
+
+
+def save_variants(sheet, variants, quality=100, optimize=True):
+    """
+    Saves every variant of the contact sheet to its `outputfile`. Variants
+    may set `mpmax`, `quality`, `optimize` and `max_bytes`, quality and
+    optimize default to those of the sheet. Returns the output files.
+    """
+    outputfiles = []
+    for variant, image in zip(variants, derive_variants(sheet, variants)):
+        save_sheet(image, variant["outputfile"],
+                   quality=variant.get("quality", quality),
+                   optimize=variant.get("optimize", optimize),
+                   max_bytes=variant.get("max_bytes"))
+        log.info("Variant {0} successfully created!".format(
+                                    os.path.basename(variant["outputfile"])))
+        outputfiles.append(variant["outputfile"])
+    return outputfiles
+
+
 def extract_images(inputdir, outputfile, placeholder,
                    mode="floor", factor=1, wm=0, hm=0, background="white",
-                   mpmax=30, quality=100, optimize=True):
+                   mpmax=30, quality=100, optimize=True, max_bytes=None,
+                   decode_mpmax=DECODE_MPMAX, decode_timeout=None,
+                   decoder=None, atlas=None, variants=None):
     """
     Extracts images from moodle portfolio export and combines them to create
-    a contact sheet.
+    a contact sheet. If `max_bytes` is given, the sheet is encoded to fit
+    into that many bytes. Images exceeding `decode_mpmax` megapixels or
+    `decode_timeout` seconds of decoding (in the worker processes of
+    `decoder`) or failing to decode are replaced by the placeholder.
+    If an `atlas` directory is given, the resized tiles are stored there for
+    later re-layouts (see `relayout`). Smaller `variants` of the sheet are
+    derived from the same layout (see `save_variants`), in which case a list
+    of all output files is returned.
     """
     # get the first html file in the directory
     try:
@@ -90,73 +411,56 @@ def extract_images(inputdir, outputfile, placeholder,
     except IndexError:
         log.warn("No HTML file found in portfolio dir! Aborting...")
         return
-    # init list for image paths
-    image_sets = []
     # collect image paths as sets per <div> tag in the html file
     log.write("--------------------------------------------------------------")
     log.info("Extracting images for {0} ... ".format(inputdir))
     with open(filepath, "r") as f:
-        # parse file using beautifulsoup
-        soup = bs4.BeautifulSoup(f, "html.parser")
-        # extract all divs from the file
-        divs = soup.find_all("div")
-        log.info("{0} entries found...".format(len(divs)))
-        # loop over all divs
-        for i, div in enumerate(divs):
-            img_set = [img["src"] for img in div.find_all("img")]
-            img_set = [verify_img(sanitize(os.path.join(inputdir, img)),
-                                  placeholder) for img in img_set]
-            image_sets.append(tuple(img_set))
-
-    # create temporary directory
-    tempdir = sanitize(os.path.join(inputdir,
-                                    ".__tempcontactsheet"))
-    os.makedirs(tempdir, exist_ok=True)
-    # loop over all image sets and create contactsheet
-    preprocessed_set = []
-    for i, img_set in enumerate(image_sets):
-        if len(img_set) == 1:
-            preprocessed_set.append(img_set[0])
-        else:
-            log.prog("Preprocessing image set {0} / {1} ({2} %)".format(
-                                i + 1,
-                                len(image_sets),
-                                math.floor(((i + 1) / len(image_sets)) * 100)))
-            sfn = "tempsheet_{0}.jpg".format(str(i).zfill(
-                                                    len(str(len(image_sets)))))
-            sheetfile = sanitize(os.path.join(tempdir, sfn))
-            sheet = contactsheet.create_tiled_image(img_set,
-                                                    mode=mode,
-                                                    factor=factor,
-                                                    wm=wm,
-                                                    hm=hm,
-                                                    background=background)
-            sheet.convert("RGB").save(sheetfile)
-            preprocessed_set.append(sheetfile)
+        image_sets = [tuple(verify_img(sanitize(os.path.join(inputdir, img)),
+                                       placeholder) for img in img_set)
+                      for img_set in parse_portfolio(f)]
     # specify output file
     log.info("Creating contact sheet {0}...".format(outputfile))
-    sheet = contactsheet.create_tiled_image(preprocessed_set,
-                                            mode=mode,
-                                            factor=factor,
-                                            wm=wm,
-                                            hm=hm,
-                                            background=background,
-                                            mpmax=mpmax)
-    sheet.convert("RGB").save(sanitize(outputfile),
-                              quality=quality,
-                              optimize=optimize)
-    shutil.rmtree(tempdir)
+    sheet = build_sheet(image_sets,
+                        placeholder,
+                        atlas=atlas,
+                        mode=mode,
+                        factor=factor,
+                        wm=wm,
+                        hm=hm,
+                        background=background,
+                        mpmax=mpmax,
+                        decode_mpmax=decode_mpmax,
+                        decode_timeout=decode_timeout,
+                        decoder=decoder)
+    save_sheet(sheet, outputfile,
+               quality=quality,
+               optimize=optimize,
+               max_bytes=max_bytes)
     log.info("Contact sheet {0} successfully created!".format(
                                                  os.path.basename(outputfile)))
+    if variants:
+        return [outputfile] + save_variants(sheet, variants,
+                                            quality=quality,
+                                            optimize=optimize)
     return outputfile
 
 
 def extract_pdfs(inputdir, outputfile, placeholder,
                  mode="floor", factor=1, wm=0, hm=0, background="white",
-                 mpmax=30, quality=100, optimize=True):
+                 mpmax=30, quality=100, optimize=True, max_bytes=None,
+                 decode_mpmax=DECODE_MPMAX, decode_timeout=None, atlas=None,
+                 variants=None):
     """
     Extracts PDFs from a moodle task export and combines them to create
-    a contact sheet. PDFs will be converted to images first.
+    a contact sheet. PDFs will be converted to images first. If
+    `max_bytes` is given, the sheet is encoded to fit into that many bytes.
+    PDFs with a first page exceeding `decode_mpmax` megapixels, taking
+    longer than `decode_timeout` seconds to convert or failing to convert
+    are replaced by the placeholder.
+    If an `atlas` directory is given, the resized tiles are stored there for
+    later re-layouts (see `relayout`). Smaller `variants` of the sheet are
+    derived from the same layout (see `save_variants`), in which case a list
+    of all output files is returned.
     """
     # collect image paths as sets per <div> tag in the html file
     log.write("--------------------------------------------------------------")
@@ -187,47 +491,51 @@ def extract_pdfs(inputdir, outputfile, placeholder,
                     log.warn("No PDF file found in sub directory! Skipping...")
                     continue
         elif os.path.isfile(p) and p.endswith(".pdf"):
-            pdfs.append(pdf)
+            pdfs.append(p)
 
-    images = []
-    for i, pdf in enumerate(pdfs):
-        log.prog("Preprocessing PDF {0} / {1} ({2} %)".format(
-                                    i + 1,
-                                    len(pdfs),
-                                    math.floor(((i + 1) / len(pdfs)) * 100)))
-        # convert pdf to single images
-        try:
-            pdfpages = pdf2image.convert_from_path(pdf)
-            if len(pdfpages) > 1:
-                log.warn(("PDF {0} has more than one page! Only first page "
-                          "will be used!").format(pdf[-40:]))
-            images.append(pdfpages[0])
-        except PDFPageCountError:
-            log.warn("PDF file is corrupt! Skipping...")
-            continue
+    images = convert_pdfs(pdfs, pdfs,
+                          placeholder=placeholder,
+                          mpmax=decode_mpmax,
+                          timeout=decode_timeout)
 
     log.info("Creating contact sheet {0}...".format(outputfile))
-    sheet = contactsheet.create_tiled_image(images,
-                                            mode=mode,
-                                            factor=factor,
-                                            wm=wm,
-                                            hm=hm,
-                                            background=background,
-                                            mpmax=mpmax)
-    sheet.convert("RGB").save(sanitize(outputfile),
-                              quality=quality,
-                              optimize=optimize)
+    sheet = build_sheet([[image] for image in images],
+                        placeholder,
+                        atlas=atlas,
+                        mode=mode,
+                        factor=factor,
+                        wm=wm,
+                        hm=hm,
+                        background=background,
+                        mpmax=mpmax)
+    save_sheet(sheet, outputfile,
+               quality=quality,
+               optimize=optimize,
+               max_bytes=max_bytes)
     log.info("Contact sheet {0} successfully created!".format(
                                                  os.path.basename(outputfile)))
+    if variants:
+        return [outputfile] + save_variants(sheet, variants,
+                                            quality=quality,
+                                            optimize=optimize)
     return outputfile
 
 
 def extract_tiles(inputdir, outputfile, placeholder,
                   mode="floor", factor=1, wm=0, hm=0, background="white",
-                  mpmax=30, quality=100, optimize=True):
+                  mpmax=30, quality=100, optimize=True, max_bytes=None,
+                  decode_mpmax=DECODE_MPMAX, decode_timeout=None, decoder=None,
+                  atlas=None, variants=None):
     """
     Extracts images from moodle portfolio export and combines them to create
-    a contact sheet.
+    a contact sheet. If `max_bytes` is given, the sheet is encoded to fit
+    into that many bytes. Images exceeding `decode_mpmax` megapixels or
+    `decode_timeout` seconds of decoding (in the worker processes of
+    `decoder`) or failing to decode are replaced by the placeholder.
+    If an `atlas` directory is given, the resized tiles are stored there for
+    later re-layouts (see `relayout`). Smaller `variants` of the sheet are
+    derived from the same layout (see `save_variants`), in which case a list
+    of all output files is returned.
     """
     # get the first html file in the directory
     try:
@@ -235,37 +543,64 @@ def extract_tiles(inputdir, outputfile, placeholder,
     except IndexError:
         log.warn("No HTML file found in portfolio dir! Aborting...")
         return
-    # init list for image paths
-    tile_set = []
-    # collect image paths as sets per <div> tag in the html file
+    # collect the first image path per <div> tag in the html file
     log.write("--------------------------------------------------------------")
     log.info("Extracting images for {0} ... ".format(inputdir))
     with open(filepath, "r") as f:
-        # parse file using beautifulsoup
-        soup = bs4.BeautifulSoup(f, "html.parser")
-        # extract all divs from the file
-        divs = soup.find_all("div")
-        log.info("{0} entries found...".format(len(divs)))
-        # loop over all divs
-        for i, div in enumerate(divs):
-            tile = [img["src"] for img in div.find_all("img")][0]
-            tile = verify_img(sanitize(os.path.join(inputdir, tile)),
-                              placeholder)
-            tile_set.append(tile)
+        tile_set = [verify_img(sanitize(os.path.join(inputdir, img_set[0])),
+                               placeholder)
+                    for img_set in parse_portfolio(f) if img_set]
 
     # specify output file
     log.info("Creating contact sheet {0}...".format(outputfile))
 
-    sheet = contactsheet.create_tiled_image(tile_set,
-                                            mode=mode,
-                                            factor=factor,
-                                            wm=wm,
-                                            hm=hm,
-                                            background=background,
-                                            mpmax=mpmax)
-    sheet.convert("RGB").save(sanitize(outputfile),
-                              quality=quality,
-                              optimize=optimize)
+    sheet = build_sheet([[tile] for tile in tile_set],
+                        placeholder,
+                        atlas=atlas,
+                        mode=mode,
+                        factor=factor,
+                        wm=wm,
+                        hm=hm,
+                        background=background,
+                        mpmax=mpmax,
+                        decode_mpmax=decode_mpmax,
+                        decode_timeout=decode_timeout,
+                        decoder=decoder)
+    save_sheet(sheet, outputfile,
+               quality=quality,
+               optimize=optimize,
+               max_bytes=max_bytes)
+    log.info("Contact sheet {0} successfully created!".format(
+                                                 os.path.basename(outputfile)))
+    if variants:
+        return [outputfile] + save_variants(sheet, variants,
+                                            quality=quality,
+                                            optimize=optimize)
+    return outputfile
+
+
+def relayout(atlas, outputfile=None, mode="floor", factor=1, wm=0, hm=0,
+             center=True, background="white", mpmax=30, quality=100,
+             optimize=True, max_bytes=None):
+    """
+    Composes a new contact sheet from a tile atlas written by one of the
+    extractors, without parsing or decoding the export again. Returns the
+    sheet as an image if no output file is specified.
+    """
+    sheet = compose_atlas(sanitize(atlas),
+                          mode=mode,
+                          factor=factor,
+                          wm=wm,
+                          hm=hm,
+                          center=center,
+                          background=background,
+                          mpmax=mpmax)
+    if outputfile is None:
+        return sheet
+    save_sheet(sheet, outputfile,
+               quality=quality,
+               optimize=optimize,
+               max_bytes=max_bytes)
     log.info("Contact sheet {0} successfully created!".format(
                                                  os.path.basename(outputfile)))
     return outputfile
@@ -0,0 +1,211 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import io
+import multiprocessing
+from multiprocessing.connection import wait
+import os
+import threading
+import time
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet.layout import fit_image
+
+
+# CONSTANTS -------------------------------------------------------------------
+
+DECODE_MPMAX = 100
+"""int: Default megapixel limit of a single image."""
+
+
+# FUNCTION DEFINITIONS---------------------------------------------------------
+
+def read_size(source, mpmax=DECODE_MPMAX):
+    """
+    Returns a tuple of (size, error) for the image at `source` (a path, file
+    object or bytes), reading only its header. The error is a message if the
+    image can't be identified or exceeds `mpmax` megapixels, otherwise None.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        with Image.open(source) as img:
+            size = img.size
+    except Exception as e:
+        return None, "Image could not be read ({0})".format(e)
+    if mpmax and size[0] * size[1] > mpmax * 1000000:
+        return None, "Image has {0:.1f} MP, limit is {1} MP".format(
+                                        size[0] * size[1] / 1000000, mpmax)
+    return size, None
+
+
+def decode_image(source, bounds):
+    """
+    Returns a tuple of (images, error) with the image at `source` (a path,
+    file object or bytes) decoded once and shrunk to every bound (see
+    `fit_image`), or None and a message if it could not be decoded.
+    """
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    try:
+        return fit_image(source, bounds), None
+    except Exception as e:
+        return None, "Image could not be decoded ({0})".format(e)
+
+
+def decode_images(jobs, timeout=None, decoder=None):
+    """
+    Decodes the images of all (source, bounds) jobs and returns one result
+    of `decode_image` per job. Without a `timeout`, images are decoded in
+    this process, otherwise by the `decoder` or a temporary one.
+    """
+    if not timeout:
+        return [decode_image(*job) for job in jobs]
+    if decoder is None:
+        with Decoder() as decoder:
+            return decoder.map(jobs, timeout)
+    return decoder.map(jobs, timeout)
+
+
+# DECODER ---------------------------------------------------------------------
+
+def _work(conn):
+    """
+    Main loop of a decoding worker, decoding (source, bounds) jobs received
+    through `conn` until it is closed.
+    """
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        conn.send(decode_image(*job))
+
+
+class Decoder(object):
+    """
+    Worker processes decoding images within a time budget. Starting workers
+    is expensive, so a decoder should be kept for many sheets, it may be
+    shared between threads. Workers are started on first use and every job
+    runs on a worker of its own, so a stuck image only ever blocks, and
+    gets, its own worker killed.
+    """
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count() or 1
+        self._context = multiprocessing.get_context("spawn")
+        self._condition = threading.Condition()
+        self._idle = []
+        self._running = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _acquire(self, block=True):
+        """
+        Returns an idle worker as a tuple of (process, connection), starting
+        one if there are less than `workers`. If all are busy, waits for one
+        or returns None if `block` is False.
+        """
+        with self._condition:
+            while True:
+                if self._idle:
+                    return self._idle.pop()
+                if len(self._running) < self.workers:
+                    conn, child = self._context.Pipe()
+                    process = self._context.Process(target=_work,
+                                                    args=(child,),
+                                                    daemon=True)
+                    process.start()
+                    child.close()
+                    self._running.add(process)
+                    return process, conn
+                if not block:
+                    return None
+                self._condition.wait()
+
+    def _release(self, worker, kill=False):
+        """
+        Returns a worker to the idle ones, or kills it.
+        """
+        with self._condition:
+            if kill or worker[0] not in self._running:
+                self._running.discard(worker[0])
+                worker[0].kill()
+                worker[0].join()
+                worker[1].close()
+            else:
+                self._idle.append(worker)
+            self._condition.notify()
+
+    def map(self, jobs, timeout):
+        """
+        Returns the result of `decode_image` for every (source, bounds) job.
+        Every image taking longer than `timeout` seconds is reported as not
+        decodable. Jobs are only consumed once a worker is ready for them.
+        """
+        jobs = enumerate(jobs)
+        job = next(jobs, None)
+        results = {}
+        pending = {}
+        while job is not None or pending:
+            # hand out jobs while workers are idle, waiting only for one if
+            # nothing is running
+            while job is not None:
+                worker = self._acquire(block=not pending)
+                if worker is None:
+                    break
+                try:
+                    worker[1].send(job[1])
+                except (OSError, ValueError) as e:
+                    results[job[0]] = (None, "Image could not be decoded "
+                                             "({0})".format(e))
+                    self._release(worker, kill=True)
+                else:
+                    # the budget starts once a worker has the image
+                    pending[worker[1]] = (worker, job[0],
+                                          time.monotonic() + timeout)
+                job = next(jobs, None)
+            if not pending:
+                continue
+            deadline = min(p[2] for p in pending.values())
+            for conn in wait(list(pending),
+                             max(0, deadline - time.monotonic())):
+                worker, index, _ = pending.pop(conn)
+                try:
+                    results[index] = conn.recv()
+                except (EOFError, OSError) as e:
+                    results[index] = (None, "Image could not be decoded "
+                                            "({0})".format(e))
+                    self._release(worker, kill=True)
+                else:
+                    self._release(worker)
+            # workers still decoding can't be stopped, so replace them
+            now = time.monotonic()
+            for conn, (worker, index, deadline) in list(pending.items()):
+                if deadline <= now:
+                    del pending[conn]
+                    results[index] = (None, "Image decoding exceeded {0} "
+                                            "s".format(timeout))
+                    self._release(worker, kill=True)
+        return [results[i] for i in range(len(results))]
+
+    def close(self):
+        """
+        Stops all workers, busy ones once they have finished their job.
+        """
+        with self._condition:
+            for process, conn in self._idle:
+                process.kill()
+                process.join()
+                conn.close()
+            self._idle = []
+            self._running = set()
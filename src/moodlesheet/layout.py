@@ -0,0 +1,162 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import math
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet.contactsheet import contactsheet
+
+
+# CONSTANTS -------------------------------------------------------------------
+
+MODES = ("original", "average", "floor")
+"""tuple: Layout modes of the contactsheet module."""
+
+CELL_MPMAX = 30
+"""int: Megapixel limit of entries combining more than one image."""
+
+
+# FUNCTION DEFINITIONS---------------------------------------------------------
+
+def plan_sheet(entry_sizes, mode="floor", factor=1, wm=0, hm=0, mpmax=30):
+    """
+    Computes the layout of a contact sheet from the image sizes alone, given
+    as one list of sizes per entry. Entries with more than one image are
+    laid out as a sheet of their own, which is then scaled to fit its tile.
+
+    Returns a dict with the `grid_size`, `tile_size`, `output_size` and
+    margins of the sheet and one cell per entry. Every cell holds its scaled
+    `size`, the `grid_size`, `tile_size` and margins of its own grid (None
+    for single images) and the `bounds` every image has to fit into.
+    """
+    if not entry_sizes:
+        return {"grid_size": (1, 1), "tile_size": (1, 1),
+                "output_size": (1, 1), "wm": wm, "hm": hm, "cells": []}
+    # lay out entries of more than one image first
+    cells = []
+    for sizes in entry_sizes:
+        if len(sizes) == 1:
+            cells.append({"size": tuple(sizes[0]), "grid_size": None})
+        elif not sizes:
+            cells.append({"size": (1, 1), "grid_size": None})
+        else:
+            grid_size = contactsheet.get_grid_size(len(sizes))
+            image_size = contactsheet.get_image_size(sizes, mode=mode)
+            tile_size, size = contactsheet.get_tiled_image_dimensions(
+                                                    grid_size,
+                                                    image_size,
+                                                    factor=factor,
+                                                    wm=wm,
+                                                    hm=hm,
+                                                    mpmax=CELL_MPMAX)
+            cells.append({"size": size, "grid_size": grid_size,
+                          "tile_size": tile_size, "wm": wm, "hm": hm})
+    # lay out the entries in the sheet
+    grid_size = contactsheet.get_grid_size(len(cells))
+    image_size = contactsheet.get_image_size([c["size"] for c in cells],
+                                             mode=mode)
+    tile_size, output_size = contactsheet.get_tiled_image_dimensions(
+                                                    grid_size,
+                                                    image_size,
+                                                    factor=factor,
+                                                    wm=wm,
+                                                    hm=hm,
+                                                    mpmax=mpmax)
+    tile_size = (max(1, tile_size[0]), max(1, tile_size[1]))
+    # scale combined entries to their tile, like a thumbnail would
+    for cell, sizes in zip(cells, entry_sizes):
+        if cell["grid_size"] is None:
+            cell["bounds"] = [tile_size] * len(sizes)
+            continue
+        sf = min(1.0, tile_size[0] / cell["size"][0],
+                 tile_size[1] / cell["size"][1])
+        cell["size"] = (max(1, math.floor(cell["size"][0] * sf)),
+                        max(1, math.floor(cell["size"][1] * sf)))
+        cell["tile_size"] = (max(1, math.floor(cell["tile_size"][0] * sf)),
+                             max(1, math.floor(cell["tile_size"][1] * sf)))
+        cell["wm"] = math.floor(cell["wm"] * sf)
+        cell["hm"] = math.floor(cell["hm"] * sf)
+        # images are never upscaled into their tile before the entry is
+        # scaled, so smaller images stay smaller than the tile
+        cell["bounds"] = [(min(cell["tile_size"][0],
+                               max(1, math.floor(size[0] * sf))),
+                           min(cell["tile_size"][1],
+                               max(1, math.floor(size[1] * sf))))
+                          for size in sizes]
+    return {"grid_size": grid_size, "tile_size": tile_size,
+            "output_size": output_size, "wm": wm, "hm": hm, "cells": cells}
+
+
+def get_max_bounds(entry_sizes, factor=1, mpmax=30):
+    """
+    Returns the largest bounds of every image any layout mode can produce.
+    Margins only ever shrink the tiles, so they are ignored.
+    """
+    bounds = [[(1, 1)] * len(sizes) for sizes in entry_sizes]
+    for mode in MODES:
+        plan = plan_sheet(entry_sizes, mode=mode, factor=factor, mpmax=mpmax)
+        for entry, cell in zip(bounds, plan["cells"]):
+            for i, bound in enumerate(cell["bounds"]):
+                entry[i] = (max(entry[i][0], bound[0]),
+                            max(entry[i][1], bound[1]))
+    return bounds
+
+
+def fit_image(image, bounds):
+    """
+    Decodes the image (a path, file object or image object) once and
+    returns one RGB copy of it per bound, each shrunk to fit into it.
+    """
+    image = contactsheet._get_image_object(image)
+    # let JPEG files decode at a reduced scale right away
+    image.draft("RGB", (max(b[0] for b in bounds), max(b[1] for b in bounds)))
+    image = image.convert("RGB")
+    fitted = []
+    for bound in bounds:
+        copy = image.copy()
+        copy.thumbnail(bound)
+        fitted.append(copy)
+    return fitted
+
+
+def compose_sheet(plan, entries, center=True, background="white"):
+    """
+    Composes the contact sheet planned by `plan_sheet` from the images of
+    every entry. Images larger than their bounds are downscaled in place.
+    """
+    if not plan["cells"]:
+        return Image.new("RGB", (1, 1), "black")
+    final_image = Image.new("RGB", plan["output_size"], background)
+    for i, (cell, images) in enumerate(zip(plan["cells"], entries)):
+        if cell["grid_size"] is None:
+            image = images[0] if images else Image.new("RGB", (1, 1),
+                                                       "black")
+        else:
+            # combine the images of the entry into a single tile
+            image = Image.new("RGB", cell["size"], background)
+            for j, img in enumerate(images):
+                contactsheet.insert_image_into_grid(
+                                image,
+                                cell["tile_size"],
+                                img,
+                                contactsheet.get_location_in_grid(
+                                                    cell["grid_size"], j),
+                                wm=cell["wm"],
+                                hm=cell["hm"],
+                                center=center)
+        contactsheet.insert_image_into_grid(
+                                final_image,
+                                plan["tile_size"],
+                                image,
+                                contactsheet.get_location_in_grid(
+                                                    plan["grid_size"], i),
+                                wm=plan["wm"],
+                                hm=plan["hm"],
+                                center=center)
+    return final_image
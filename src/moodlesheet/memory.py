@@ -0,0 +1,319 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import io
+import os
+import posixpath
+import zipfile
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet.extract import (build_sheet,
+                                 convert_pdfs,
+                                 derive_variants,
+                                 encode_sheet,
+                                 log,
+                                 parse_portfolio)
+from moodlesheet.guard import DECODE_MPMAX
+
+
+# EXPORTS ---------------------------------------------------------------------
+
+class Export(object):
+    """
+    Read-only view of a moodle export given as zip archive (bytes, file
+    object or path), as mapping of relative file names to bytes or file
+    objects, or as an already unzipped directory. Use it as a context
+    manager or `close` it to release the zip archive.
+    """
+    def __init__(self, source):
+        self._files = None
+        self._zip = None
+        self._dir = None
+        if isinstance(source, dict):
+            self._files = {_normalize(n): d for n, d in source.items()}
+            names = self._files.keys()
+        elif isinstance(source, str) and os.path.isdir(source):
+            self._dir = source
+            names = [os.path.relpath(os.path.join(d, fn), source)
+                     for d, _, fns in os.walk(source) for fn in fns]
+        else:
+            if isinstance(source, (bytes, bytearray)):
+                source = io.BytesIO(source)
+            self._zip = zipfile.ZipFile(source, "r")
+            names = [n for n in self._zip.namelist() if not n.endswith("/")]
+        # sorted relative posix names of all files in the export
+        self.names = sorted(_normalize(n) for n in names)
+        self._nameset = set(self.names)
+
+    def __contains__(self, name):
+        return name in self._nameset
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self, name):
+        """
+        Returns a binary file object for the file with the given relative
+        name, to be closed by the caller.
+        """
+        if name not in self._nameset:
+            raise KeyError(name)
+        if self._files is not None:
+            data = self._files[name]
+            if not isinstance(data, (bytes, bytearray)):
+                data.seek(0)
+                data = data.read()
+            return io.BytesIO(data)
+        if self._zip is not None:
+            return self._zip.open(name, "r")
+        return open(os.path.join(self._dir, *name.split("/")), "rb")
+
+    def read(self, name):
+        """
+        Returns the contents of the file with the given relative name.
+        """
+        with self.open(name) as f:
+            return f.read()
+
+    def close(self):
+        """
+        Closes the zip archive of the export, if any.
+        """
+        if self._zip is not None:
+            self._zip.close()
+
+
+def _normalize(name):
+    """
+    Returns the normalized relative posix form of a file name.
+    """
+    return posixpath.normpath(name.replace("\\", "/")).lstrip("/")
+
+
+def _find_html(export):
+    """
+    Returns the name of the first HTML file in the root of the export.
+    """
+    for name in export.names:
+        if "/" not in name and name.endswith(".html"):
+            return name
+    log.warn("No HTML file found in portfolio export! Aborting...")
+    return None
+
+
+def _resolve(export, src):
+    """
+    Returns the name of the image referenced by `src` in the export, or None
+    if the image is missing and the placeholder should be used instead.
+    """
+    name = _normalize(src)
+    if name in export:
+        return name
+    if ".." in src:
+        name = _normalize(src.replace("..", "."))
+        if name in export:
+            return name
+    log.warn(("Image file ...{0} not found! Inserting "
+              "placeholder...").format(src[-45:]))
+    return None
+
+
+def _find_pdfs(export):
+    """
+    Returns the names of the PDF files in the export, the first one of each
+    top-level directory (or of its first sub directory) and all in the root.
+    """
+    pdfs = []
+    groups = {}
+    for name in export.names:
+        if not name.lower().endswith(".pdf"):
+            continue
+        parts = name.split("/")
+        if len(parts) == 1:
+            pdfs.append(name)
+        elif len(parts) <= 3:
+            # prefer PDFs directly inside the top-level directory
+            groups.setdefault(parts[0], []).append((len(parts), name))
+    pdfs.extend(min(group)[1] for _, group in sorted(groups.items()))
+    return pdfs
+
+
+def _get_placeholder(placeholder):
+    """
+    Returns the placeholder as an image. Supports paths, bytes and images,
+    if no placeholder is supplied a plain grey image is used.
+    """
+    if placeholder is None:
+        return Image.new("RGB", (640, 480), "lightgrey")
+    if isinstance(placeholder, Image.Image):
+        return placeholder
+    if isinstance(placeholder, (bytes, bytearray)):
+        placeholder = io.BytesIO(placeholder)
+    placeholder = Image.open(placeholder)
+    placeholder.load()
+    return placeholder
+
+
+def _finish(sheet, as_image=False, fmt="JPEG", quality=100, optimize=True,
+            max_bytes=None, variants=None):
+    """
+    Returns the sheet as image or encoded bytes. If `variants` are given,
+    a list of the sheet followed by all variants is returned.
+    """
+    images = [sheet]
+    settings = [{"fmt": fmt, "quality": quality, "optimize": optimize,
+                 "max_bytes": max_bytes}]
+    if variants:
+        images.extend(derive_variants(sheet, variants))
+        settings.extend(variants)
+    if not as_image:
+        images = [encode_sheet(image,
+                               fmt=setting.get("fmt", fmt),
+                               quality=setting.get("quality", quality),
+                               optimize=setting.get("optimize", optimize),
+                               max_bytes=setting.get("max_bytes"))
+                  for image, setting in zip(images, settings)]
+        log.info("Contact sheet successfully created ({0} bytes)!".format(
+                                    " / ".join(str(len(i)) for i in images)))
+    return images if variants else images[0]
+
+
+# FUNCTION DEFINITIONS---------------------------------------------------------
+
+def render_images(source, placeholder=None,
+                  mode="floor", factor=1, wm=0, hm=0, background="white",
+                  mpmax=30, fmt="JPEG", quality=100, optimize=True,
+                  max_bytes=None, decode_mpmax=DECODE_MPMAX,
+                  decode_timeout=None, decoder=None, atlas=None,
+                  variants=None, as_image=False):
+    """
+    In-memory version of `extract_images`. Creates a contact sheet from a
+    moodle portfolio export (see `Export` for the supported sources) and
+    returns it encoded as `fmt`, or as image if `as_image` is True. Each of
+    the `variants` may set `mpmax`, `fmt`, `quality`, `optimize` and
+    `max_bytes` and is derived from the same layout, in which case a list of
+    the sheet followed by all variants is returned.
+    """
+    log.write("--------------------------------------------------------------")
+    with Export(source) as export:
+        html = _find_html(export)
+        if html is None:
+            return
+        log.info("Extracting images for {0} ... ".format(html))
+        image_sets = [tuple(_resolve(export, img) for img in img_set)
+                      for img_set in parse_portfolio(export.read(html))]
+        placeholder = _get_placeholder(placeholder)
+        image_sets = [[placeholder if img is None else img
+                       for img in img_set]
+                      for img_set in image_sets]
+        sheet = build_sheet(image_sets,
+                            placeholder,
+                            atlas=atlas,
+                            mode=mode,
+                            factor=factor,
+                            wm=wm,
+                            hm=hm,
+                            background=background,
+                            mpmax=mpmax,
+                            decode_mpmax=decode_mpmax,
+                            decode_timeout=decode_timeout,
+                            decoder=decoder,
+                            opener=export.open)
+    return _finish(sheet, as_image=as_image, fmt=fmt, quality=quality,
+                   optimize=optimize, max_bytes=max_bytes, variants=variants)
+
+
+def render_pdfs(source, placeholder=None,
+                mode="floor", factor=1, wm=0, hm=0, background="white",
+                mpmax=30, fmt="JPEG", quality=100, optimize=True,
+                max_bytes=None, decode_mpmax=DECODE_MPMAX,
+                decode_timeout=None, atlas=None, variants=None,
+                as_image=False):
+    """
+    In-memory version of `extract_pdfs`. Creates a contact sheet from a
+    moodle task export (see `Export` for the supported sources) or a list of
+    PDFs as bytes and returns it encoded as `fmt`, or as image if `as_image`
+    is True. Note that poppler only reads PDFs from files, so every PDF is
+    written to a temporary file of its own for the time of its conversion.
+    See `render_images` for `variants`.
+    """
+    log.write("--------------------------------------------------------------")
+    placeholder = _get_placeholder(placeholder)
+    if isinstance(source, (list, tuple)):
+        log.info("Extracting {0} PDFs ... ".format(len(source)))
+        images = convert_pdfs(source,
+                              ["PDF #{0}".format(i + 1)
+                               for i in range(len(source))],
+                              placeholder=placeholder,
+                              mpmax=decode_mpmax,
+                              timeout=decode_timeout,
+                              read=bytes)
+    else:
+        with Export(source) as export:
+            names = _find_pdfs(export)
+            log.info("Extracting {0} PDFs ... ".format(len(names)))
+            images = convert_pdfs(names, names,
+                                  placeholder=placeholder,
+                                  mpmax=decode_mpmax,
+                                  timeout=decode_timeout,
+                                  read=export.read)
+    sheet = build_sheet([[image] for image in images],
+                        placeholder,
+                        atlas=atlas,
+                        mode=mode,
+                        factor=factor,
+                        wm=wm,
+                        hm=hm,
+                        background=background,
+                        mpmax=mpmax)
+    return _finish(sheet, as_image=as_image, fmt=fmt, quality=quality,
+                   optimize=optimize, max_bytes=max_bytes, variants=variants)
+
+
+def render_tiles(source, placeholder=None,
+                 mode="floor", factor=1, wm=0, hm=0, background="white",
+                 mpmax=30, fmt="JPEG", quality=100, optimize=True,
+                 max_bytes=None, decode_mpmax=DECODE_MPMAX,
+                 decode_timeout=None, decoder=None, atlas=None,
+                 variants=None, as_image=False):
+    """
+    In-memory version of `extract_tiles`. Creates a contact sheet of the
+    first image per entry of a moodle portfolio export (see `Export` for the
+    supported sources) and returns it encoded as `fmt`, or as image if
+    `as_image` is True. See `render_images` for `variants`.
+    """
+    log.write("--------------------------------------------------------------")
+    with Export(source) as export:
+        html = _find_html(export)
+        if html is None:
+            return
+        log.info("Extracting images for {0} ... ".format(html))
+        tile_set = [_resolve(export, img_set[0])
+                    for img_set in parse_portfolio(export.read(html))
+                    if img_set]
+        placeholder = _get_placeholder(placeholder)
+        sheet = build_sheet([[placeholder if tile is None else tile]
+                             for tile in tile_set],
+                            placeholder,
+                            atlas=atlas,
+                            mode=mode,
+                            factor=factor,
+                            wm=wm,
+                            hm=hm,
+                            background=background,
+                            mpmax=mpmax,
+                            decode_mpmax=decode_mpmax,
+                            decode_timeout=decode_timeout,
+                            decoder=decoder,
+                            opener=export.open)
+    return _finish(sheet, as_image=as_image, fmt=fmt, quality=quality,
+                   optimize=optimize, max_bytes=max_bytes, variants=variants)
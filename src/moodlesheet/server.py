@@ -0,0 +1,364 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import argparse
+from collections import OrderedDict
+from concurrent.futures import Future
+import hashlib
+import math
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import os
+import threading
+import zipfile
+from urllib.parse import parse_qs, urlparse
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import ImageColor
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet.encode import MIN_BYTES
+from moodlesheet.extract import log, sanitize
+from moodlesheet.guard import DECODE_MPMAX, Decoder
+from moodlesheet.layout import MODES
+from moodlesheet.memory import render_images, render_pdfs, render_tiles
+
+
+# CONSTANTS -------------------------------------------------------------------
+
+RENDERERS = {
+    "images": render_images,
+    "pdfs": render_pdfs,
+    "tiles": render_tiles,
+}
+"""dict: Mapping of request kinds to the function building the sheet."""
+
+PARAMETERS = {
+    "mode": str,
+    "factor": float,
+    "wm": int,
+    "hm": int,
+    "background": str,
+    "mpmax": float,
+    "quality": int,
+    "max_bytes": int,
+}
+"""dict: Layout parameters accepted by the service and their converters."""
+
+LIMITS = {
+    "factor": (0.0, 4.0),
+    "wm": (0, 100),
+    "hm": (0, 100),
+    "mpmax": (0.01, 50.0),
+    "quality": (1, 100),
+}
+"""dict: Ranges the numeric layout parameters are clamped to."""
+
+CHUNK_SIZE = 64 * 1024
+"""int: Number of bytes written to the socket per chunk."""
+
+
+# EXCEPTIONS ------------------------------------------------------------------
+
+class RequestError(ValueError):
+    """
+    Raised if a sheet request is invalid or cannot be fulfilled.
+    """
+    def __init__(self, message, status=400):
+        super(RequestError, self).__init__(message)
+        self.status = status
+
+
+# SHEET SERVICE ---------------------------------------------------------------
+
+class SheetService(object):
+    """
+    Builds contact sheets for export directories and zip archives below
+    `root`.
+
+    Concurrent identical requests are coalesced into a single build and
+    finished sheets are cached by export contents and layout parameters.
+    At most `cache_size` sheets totalling `cache_bytes` are cached. Images
+    exceeding `decode_mpmax` megapixels or `decode_timeout` seconds of
+    decoding are replaced by the placeholder, all builds share one pool of
+    decoding workers.
+    """
+    def __init__(self, root, placeholder, cache_size=32,
+                 cache_bytes=256 * 1024 * 1024, decode_mpmax=DECODE_MPMAX,
+                 decode_timeout=30):
+        self.root = sanitize(root)
+        self.placeholder = placeholder
+        self.cache_size = cache_size
+        self.cache_bytes = cache_bytes
+        self.decode_mpmax = decode_mpmax
+        self.decode_timeout = decode_timeout
+        self.decoder = Decoder() if decode_timeout else None
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._cache = OrderedDict()
+        self._cached_bytes = 0
+
+    def resolve(self, path):
+        """
+        Returns the absolute export directory or zip archive for a path
+        relative to root.
+        """
+        inputpath = sanitize(os.path.join(self.root, path))
+        if os.path.commonpath([self.root, inputpath]) != self.root:
+            raise RequestError("Path {0} is outside of the served "
+                               "root!".format(path), status=403)
+        if not (os.path.isdir(inputpath) or zipfile.is_zipfile(inputpath)):
+            raise RequestError("Export {0} not found!".format(path),
+                               status=404)
+        return inputpath
+
+    def fingerprint(self, inputpath):
+        """
+        Returns a digest over names, sizes and modification times of the zip
+        archive or of all files in the export directory.
+        """
+        digest = hashlib.sha1()
+        if os.path.isdir(inputpath):
+            filepaths = [os.path.join(dirpath, fn)
+                         for dirpath, _, filenames in os.walk(inputpath)
+                         for fn in filenames]
+        else:
+            filepaths = [inputpath]
+        for fp in sorted(filepaths):
+            try:
+                st = os.stat(fp)
+            except OSError:
+                continue
+            digest.update("{0}|{1}|{2}\n".format(
+                                os.path.relpath(fp, inputpath),
+                                st.st_size,
+                                st.st_mtime_ns).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, kind, path, params):
+        """
+        Returns a tuple of (etag, sheet bytes) for the requested export,
+        building the sheet only if no identical build is cached or running.
+        """
+        if kind not in RENDERERS:
+            raise RequestError("Unknown kind {0}!".format(kind))
+        inputpath = self.resolve(path)
+        key = hashlib.sha1(repr((kind,
+                                 inputpath,
+                                 self.fingerprint(inputpath),
+                                 sorted(params.items()))).encode(
+                                                    "utf-8")).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return key, self._cache[key]
+            build = self._inflight.get(key)
+            owner = build is None
+            if owner:
+                build = Future()
+                self._inflight[key] = build
+        if not owner:
+            return key, build.result()
+        try:
+            data = self.build(kind, inputpath, params)
+        except BaseException as e:
+            with self._lock:
+                del self._inflight[key]
+            build.set_exception(e)
+            raise
+        with self._lock:
+            del self._inflight[key]
+            self._cache[key] = data
+            self._cached_bytes += len(data)
+            while self._cache and (len(self._cache) > self.cache_size or
+                                   self._cached_bytes > self.cache_bytes):
+                self._cached_bytes -= len(self._cache.popitem(last=False)[1])
+        build.set_result(data)
+        return key, data
+
+    def build(self, kind, inputpath, params):
+        """
+        Renders the sheet for `kind` in memory and returns the encoded sheet.
+        """
+        options = {"decode_mpmax": self.decode_mpmax,
+                   "decode_timeout": self.decode_timeout}
+        # PDFs are converted by poppler processes of their own
+        if kind != "pdfs":
+            options["decoder"] = self.decoder
+        options.update(params)
+        data = RENDERERS[kind](inputpath, self.placeholder, **options)
+        if data is None:
+            raise RequestError("No sheet could be created for "
+                               "{0}!".format(inputpath), status=422)
+        return data
+
+    def close(self):
+        """
+        Stops the decoding workers of the service.
+        """
+        if self.decoder is not None:
+            self.decoder.close()
+
+
+# REQUEST HANDLING ------------------------------------------------------------
+
+def parse_params(query):
+    """
+    Converts the layout parameters of a parsed query string and clamps them
+    to the limits of the service.
+    """
+    params = {}
+    for name, convert in PARAMETERS.items():
+        if name not in query:
+            continue
+        try:
+            params[name] = convert(query[name][-1])
+        except ValueError:
+            raise RequestError("Invalid value for {0}!".format(name))
+        # nan and inf would pass the clamping below unchanged
+        if convert is float and not math.isfinite(params[name]):
+            raise RequestError("Invalid value for {0}!".format(name))
+        if name in LIMITS:
+            lo, hi = LIMITS[name]
+            params[name] = min(max(params[name], lo), hi)
+    if params.get("max_bytes", MIN_BYTES) < MIN_BYTES:
+        raise RequestError("max_bytes must be at least {0}!".format(
+                                                                MIN_BYTES))
+    if params.get("mode", MODES[0]) not in MODES:
+        raise RequestError("Invalid value for mode!")
+    if "background" in params:
+        try:
+            ImageColor.getrgb(params["background"])
+        except ValueError:
+            raise RequestError("Invalid value for background!")
+    return params
+
+
+class SheetRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves GET /sheet?kind=<images|pdfs|tiles>&path=<export>&<parameters>.
+    """
+    service = None
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/sheet":
+            self.send_error(404)
+            return
+        query = parse_qs(url.query)
+        try:
+            if "path" not in query:
+                raise RequestError("Missing path!")
+            etag, data = self.service.get(query.get("kind", ["images"])[-1],
+                                          query["path"][-1],
+                                          parse_params(query))
+        except RequestError as e:
+            self.send_error(e.status, str(e))
+            return
+        except ValueError as e:
+            # e.g. a byte budget the sheet can't be encoded within
+            self.send_error(422, str(e))
+            return
+        except Exception as e:
+            log.warn("Building sheet failed: {0}".format(e))
+            self.send_error(500, "Building sheet failed!")
+            return
+        etag = '"{0}"'.format(etag)
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        view = memoryview(data)
+        for i in range(0, len(view), CHUNK_SIZE):
+            self.wfile.write(view[i:i + CHUNK_SIZE])
+
+    def log_message(self, format, *args):
+        log.info("{0} - {1}".format(self.address_string(), format % args))
+
+
+class SheetServer(ThreadingHTTPServer):
+    """
+    Threading HTTP server that closes its sheet service on shutdown.
+    """
+    def server_close(self):
+        super(SheetServer, self).server_close()
+        self.RequestHandlerClass.service.close()
+
+
+def make_server(root, placeholder, host="127.0.0.1", port=8000,
+                cache_size=32, cache_bytes=256 * 1024 * 1024,
+                decode_mpmax=DECODE_MPMAX, decode_timeout=30):
+    """
+    Returns a threading HTTP server serving sheets for exports below `root`.
+    """
+    service = SheetService(root, placeholder,
+                           cache_size=cache_size,
+                           cache_bytes=cache_bytes,
+                           decode_mpmax=decode_mpmax,
+                           decode_timeout=decode_timeout)
+    handler = type("BoundSheetRequestHandler", (SheetRequestHandler,),
+                   {"service": service})
+    return SheetServer((host, port), handler)
+
+
+def serve(root, placeholder, host="127.0.0.1", port=8000, cache_size=32,
+          cache_bytes=256 * 1024 * 1024, decode_mpmax=DECODE_MPMAX,
+          decode_timeout=30):
+    """
+    Serves sheets for exports below `root` until interrupted.
+    """
+    server = make_server(root, placeholder, host=host, port=port,
+                         cache_size=cache_size,
+                         cache_bytes=cache_bytes,
+                         decode_mpmax=decode_mpmax,
+                         decode_timeout=decode_timeout)
+    log.info("Serving contact sheets for {0} on http://{1}:{2}/sheet".format(
+                                        root, *server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main():
+    """
+    Command line entry point of the sheet service.
+    """
+    parser = argparse.ArgumentParser(
+                        description="Serve contact sheets over HTTP.")
+    parser.add_argument("root",
+                        help="directory containing the exports")
+    parser.add_argument("placeholder",
+                        help="placeholder image for missing/corrupt images")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--cache-size", type=int, default=32,
+                        help="maximum number of cached sheets")
+    parser.add_argument("--cache-mb", type=float, default=256,
+                        help="maximum total size of cached sheets in MB")
+    parser.add_argument("--decode-mpmax", type=float, default=DECODE_MPMAX,
+                        help="maximum megapixels of a single image")
+    parser.add_argument("--decode-timeout", type=float, default=30,
+                        help="maximum seconds to decode a single image")
+    args = parser.parse_args()
+    serve(args.root, args.placeholder, host=args.host, port=args.port,
+          cache_size=args.cache_size,
+          cache_bytes=int(args.cache_mb * 1024 * 1024),
+          decode_mpmax=args.decode_mpmax,
+          decode_timeout=args.decode_timeout)
+
+
+# SCRIPT ----------------------------------------------------------------------
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import os
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+import pytest
+
+
+# FIXTURES --------------------------------------------------------------------
+
+def _write_portfolio(exportdir, entries):
+    """
+    Writes a minimal moodle portfolio export with one <div> per entry, each
+    entry being a list of (width, height, color) tuples.
+    """
+    os.makedirs(os.path.join(exportdir, "site_files"))
+    divs = []
+    for i, entry in enumerate(entries):
+        imgs = []
+        for j, (width, height, color) in enumerate(entry):
+            fn = "site_files/img_{0}_{1}.jpg".format(i, j)
+            Image.new("RGB", (width, height), color).save(
+                                                os.path.join(exportdir, fn))
+            imgs.append('<img src="{0}">'.format(fn))
+        divs.append("<div>{0}</div>".format("".join(imgs)))
+    with open(os.path.join(exportdir, "Portfolio.html"), "w") as f:
+        f.write("<html><body>{0}</body></html>".format("".join(divs)))
+    return exportdir
+
+
+@pytest.fixture
+def placeholder(tmp_path):
+    fp = str(tmp_path / "placeholder.jpg")
+    Image.new("RGB", (64, 48), "grey").save(fp)
+    return fp
+
+
+@pytest.fixture
+def portfolio(tmp_path):
+    return _write_portfolio(str(tmp_path / "root" / "portfolio"), [
+        [(320, 240, "red")],
+        [(300, 240, "green"), (320, 200, "blue")],
+        [(340, 260, "yellow")],
+    ])
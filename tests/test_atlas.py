@@ -0,0 +1,62 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import os
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image, ImageChops, ImageStat
+import pytest
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet import extract_images, relayout
+from moodlesheet.atlas import read_manifest
+
+
+# FIXTURES --------------------------------------------------------------------
+
+@pytest.fixture
+def atlas(portfolio, placeholder, tmp_path):
+    atlasdir = str(tmp_path / "atlas")
+    extract_images(portfolio, str(tmp_path / "sheet.jpg"), placeholder,
+                   atlas=atlasdir)
+    return atlasdir
+
+
+# TESTS -----------------------------------------------------------------------
+
+def test_atlas_keeps_entries_apart(atlas):
+    manifest = read_manifest(atlas)
+    assert [len(tiles) for tiles in manifest["entries"]] == [1, 2, 1]
+    assert manifest["entries"][1][1]["size"] == [320, 200]
+
+
+@pytest.mark.parametrize("mode", ["original", "average", "floor"])
+def test_relayout_matches_direct_build(atlas, portfolio, placeholder,
+                                       tmp_path, mode):
+    params = {"mode": mode, "wm": 6, "hm": 4, "background": "black"}
+    outputfile = str(tmp_path / "direct.png")
+    extract_images(portfolio, outputfile, placeholder, **params)
+    with Image.open(outputfile) as direct:
+        direct = direct.convert("RGB")
+    sheet = relayout(atlas, **params)
+    assert sheet.size == direct.size
+    diff = ImageStat.Stat(ImageChops.difference(sheet, direct)).mean
+    assert max(diff) < 3
+
+
+def test_relayout_rebuilds_combined_entries(atlas):
+    # the atlas was written with a white background, none of it may remain
+    sheet = relayout(atlas, wm=8, hm=8, background="black")
+    white = sheet.convert("L").point(lambda v: 255 if v > 240 else 0)
+    assert white.getbbox() is None
+
+
+def test_relayout_writes_output(atlas, tmp_path):
+    outputfile = str(tmp_path / "relayout.jpg")
+    assert relayout(atlas, outputfile, mode="average") == outputfile
+    assert os.path.getsize(outputfile) > 0
+    # the tiles stay mapped read-only and can be composed again
+    relayout(atlas, mode="original")
@@ -0,0 +1,97 @@
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+import pytest
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet import encode
+from moodlesheet.encode import (MIN_BYTES,
+                                MIN_QUALITY,
+                                PROXY_PIXELS,
+                                encode_image,
+                                encode_to_size)
+from moodlesheet.extract import encode_sheet
+from moodlesheet.server import RequestError, parse_params
+
+
+# FIXTURES --------------------------------------------------------------------
+
+@pytest.fixture(scope="module")
+def detailed():
+    size = (1600, 1200)
+    return Image.merge("RGB", [Image.effect_noise(size, 40),
+                               Image.linear_gradient("L").resize(size),
+                               Image.effect_mandelbrot(size,
+                                                       (-2, -1.2, 1, 1.2),
+                                                       100)])
+
+
+@pytest.fixture(scope="module")
+def large():
+    size = (4000, 3000)
+    return Image.merge("RGB", [Image.effect_noise(size, 40),
+                               Image.linear_gradient("L").resize(size),
+                               Image.effect_mandelbrot(size,
+                                                       (-2, -1.5, 1, 1.5),
+                                                       100)])
+
+
+# TESTS -----------------------------------------------------------------------
+
+def test_generous_budget_keeps_quality(detailed):
+    full = len(encode_image(detailed, quality=90))
+    data, quality, scale = encode_to_size(detailed, full * 2, quality=90)
+    assert (quality, scale) == (90, 1.0)
+    assert len(data) <= full * 2
+
+
+@pytest.mark.parametrize("fraction", [0.5, 0.2, 0.05, 0.005])
+def test_budget_is_met_and_never_exceeded(detailed, fraction):
+    budget = max(MIN_BYTES, int(len(encode_image(detailed, quality=90)) *
+                                fraction))
+    data, quality, scale = encode_to_size(detailed, budget, quality=90)
+    assert len(data) <= budget
+    # the search shouldn't throw away most of the budget
+    assert len(data) > budget * 0.3
+
+
+def test_impossible_budget_raises(detailed):
+    with pytest.raises(ValueError):
+        encode_to_size(detailed, 100)
+    with pytest.raises(ValueError):
+        encode_sheet(detailed, max_bytes=50)
+
+
+def test_fallback_downscaling_meets_budget():
+    # noise can't be compressed, only the scale gets it within the budget
+    noise = Image.effect_noise((4000, 4000), 128).convert("RGB")
+    data, quality, scale = encode_to_size(noise, MIN_BYTES)
+    assert len(data) <= MIN_BYTES
+    assert quality == MIN_QUALITY and scale < 0.1
+
+
+@pytest.mark.parametrize("fraction", [0.5, 0.2, 0.05, 0.01])
+def test_at_most_two_full_encodes(large, fraction, monkeypatch):
+    full = []
+    _encode = encode._encode
+
+    def counting(image, *args, **kwargs):
+        # trial encodes of the proxy stay below PROXY_PIXELS
+        if image.width * image.height > PROXY_PIXELS:
+            full.append(args)
+        return _encode(image, *args, **kwargs)
+
+    budget = int(len(encode_image(large, quality=90)) * fraction)
+    monkeypatch.setattr(encode, "_encode", counting)
+    data, _, _ = encode_to_size(large, budget, quality=90)
+    assert len(data) <= budget
+    assert 1 <= len(full) <= 2
+
+
+def test_server_rejects_impossible_budget():
+    with pytest.raises(RequestError):
+        parse_params({"max_bytes": ["50"]})
+    assert parse_params({"max_bytes": [str(MIN_BYTES)]}) == {
+                                                    "max_bytes": MIN_BYTES}
@@ -0,0 +1,125 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import os
+import threading
+import time
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+import pytest
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet import Decoder, extract_images, render_images
+from moodlesheet.guard import decode_image, read_size
+
+
+# FIXTURES --------------------------------------------------------------------
+
+def _truncate(filepath):
+    with open(filepath, "rb") as f:
+        data = f.read()
+    with open(filepath, "wb") as f:
+        f.write(data[:len(data) // 3])
+
+
+def _center(sheet, box):
+    """Returns the color at the center of a box of the sheet."""
+    return sheet.getpixel(((box[0] + box[2]) // 2, (box[1] + box[3]) // 2))
+
+
+@pytest.fixture
+def jpeg(tmp_path):
+    filepath = str(tmp_path / "image.jpg")
+    Image.new("RGB", (800, 600), "red").save(filepath)
+    return filepath
+
+
+# TESTS -----------------------------------------------------------------------
+
+def test_read_size_checks_header_only(jpeg):
+    _truncate(jpeg)
+    assert read_size(jpeg) == ((800, 600), None)
+    size, error = read_size(jpeg, mpmax=0.1)
+    assert size is None and "limit is 0.1 MP" in error
+
+
+def test_decode_image_shrinks_to_every_bound(jpeg):
+    images, error = decode_image(jpeg, [(100, 100), (400, 400)])
+    assert error is None
+    assert [image.size for image in images] == [(100, 75), (400, 300)]
+    _truncate(jpeg)
+    images, error = decode_image(jpeg, [(100, 100)])
+    assert images is None and error
+
+
+def test_truncated_image_is_replaced_by_default(portfolio, placeholder,
+                                                tmp_path):
+    _truncate(os.path.join(portfolio, "site_files", "img_0_0.jpg"))
+    outputfile = str(tmp_path / "sheet.png")
+    extract_images(portfolio, outputfile, placeholder, mode="original")
+    with Image.open(outputfile) as sheet:
+        sheet = sheet.convert("RGB")
+        # the first tile shows the grey placeholder instead of red
+        r, g, b = _center(sheet, (0, 0, sheet.width // 2, sheet.height // 2))
+        assert abs(r - g) < 10 and abs(g - b) < 10
+
+
+def test_oversized_image_is_replaced(portfolio, placeholder):
+    # the third entry, a yellow image of 340x260 pixels, exceeds the limit
+    for mpmax, grey in [(None, False), (0.08, True)]:
+        sheet = render_images(portfolio, placeholder, decode_mpmax=mpmax,
+                              as_image=True)
+        r, g, b = _center(sheet, (0, sheet.height // 2,
+                                  sheet.width // 2, sheet.height))
+        assert (abs(r - g) < 10 and abs(g - b) < 10) == grey
+
+
+def test_decoder_reuses_workers_and_kills_stuck_ones(jpeg, portfolio,
+                                                      placeholder):
+    with Decoder(workers=2) as decoder:
+        results = decoder.map([(jpeg, [(80, 80)])] * 3, timeout=60)
+        assert [r[0][0].size for r in results] == [(80, 60)] * 3
+        workers = set(decoder._running)
+        sheet = render_images(portfolio, placeholder, decode_timeout=60,
+                              decoder=decoder, as_image=True)
+        assert decoder._running == workers and sheet.size[0] > 1
+        # nothing decodes within a nanosecond, so the worker is killed
+        results = decoder.map([(jpeg, [(80, 80)])], timeout=1e-9)
+        assert results[0][0] is None and "exceeded" in results[0][1]
+        assert len(decoder._running) == 1
+        assert len(decoder._running & workers) == 1
+    assert not decoder._running
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="needs named pipes")
+def test_stuck_image_does_not_delay_other_callers(jpeg, tmp_path):
+    # opening a named pipe without a writer blocks forever
+    stuck = str(tmp_path / "stuck.jpg")
+    os.mkfifo(stuck)
+    timings = {}
+
+    def decode(name, source, timeout):
+        start = time.monotonic()
+        result = decoder.map([(source, [(80, 80)])], timeout=timeout)[0]
+        timings[name] = (time.monotonic() - start, result)
+
+    with Decoder(workers=2) as decoder:
+        # start the workers, so their start-up isn't measured
+        decoder.map([(jpeg, [(80, 80)])] * 2, timeout=60)
+        threads = [threading.Thread(target=decode, args=("stuck", stuck, 5)),
+                   threading.Thread(target=decode, args=("fine", jpeg, 60))]
+        threads[0].start()
+        time.sleep(0.2)
+        threads[1].start()
+        for thread in threads:
+            thread.join()
+    elapsed, (images, error) = timings["fine"]
+    assert error is None and images[0].size == (80, 60)
+    assert elapsed < 2
+    elapsed, (images, error) = timings["stuck"]
+    assert images is None and "exceeded" in error
+    assert elapsed >= 5
@@ -0,0 +1,70 @@
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image, ImageChops
+import pytest
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet.contactsheet import contactsheet
+from moodlesheet.extract import build_sheet
+from moodlesheet.layout import plan_sheet
+
+
+# FIXTURES --------------------------------------------------------------------
+
+ENTRIES = [
+    [(1229, 792, "red"), (400, 300, "green"), (900, 900, "blue")],
+    [(800, 600, "yellow")],
+    [(300, 500, "purple"), (1000, 400, "orange")],
+    [(640, 480, "cyan")],
+]
+
+
+def _images():
+    return [[Image.new("RGB", (w, h), color) for w, h, color in entry]
+            for entry in ENTRIES]
+
+
+def _subsheet_sheet(entries, **params):
+    """
+    Builds the sheet the way the extractors originally did, laying out
+    entries of several images as a full size sheet of their own first.
+    """
+    cells = []
+    for images in entries:
+        if len(images) == 1:
+            cells.append(images[0])
+        else:
+            cells.append(contactsheet.create_tiled_image(
+                                        images,
+                                        mode=params["mode"],
+                                        factor=1,
+                                        wm=params["wm"],
+                                        hm=params["hm"],
+                                        background=params["background"]))
+    return contactsheet.create_tiled_image(cells, factor=1, **params)
+
+
+# TESTS -----------------------------------------------------------------------
+
+@pytest.mark.parametrize("mode", ["original", "average", "floor"])
+def test_sheet_matches_subsheet_geometry(mode):
+    params = {"mode": mode, "wm": 10, "hm": 10, "background": "white"}
+    expected = _subsheet_sheet(_images(), **params)
+    sheet = build_sheet(_images(), None, **params)
+    assert sheet.size == expected.size
+    # only the edges of the images may differ by rounding
+    diff = ImageChops.difference(sheet, expected).convert("L")
+    diff = diff.point(lambda v: 255 if v > 64 else 0)
+    differing = sum(diff.histogram()[1:])
+    assert differing < 0.01 * sheet.width * sheet.height
+
+
+def test_small_images_are_not_upscaled_in_combined_entries():
+    plan = plan_sheet([[(w, h) for w, h, _ in entry] for entry in ENTRIES],
+                      mode="average", wm=10, hm=10)
+    cell = plan["cells"][0]
+    # the green image is smaller than the tile of its entry
+    assert cell["bounds"][1][0] < cell["tile_size"][0]
+    assert cell["bounds"][0] == cell["tile_size"]
@@ -0,0 +1,82 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import io
+import os
+import shutil
+import zipfile
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image, ImageChops
+import pytest
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet import Export, render_images, render_pdfs, render_tiles
+from moodlesheet.extract import pdf2image
+
+
+# FIXTURES --------------------------------------------------------------------
+
+@pytest.fixture
+def archive(portfolio):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as zf:
+        for dirpath, _, filenames in os.walk(portfolio):
+            for fn in filenames:
+                fp = os.path.join(dirpath, fn)
+                zf.write(fp, os.path.relpath(fp, portfolio))
+    return buffer.getvalue()
+
+
+# TESTS -----------------------------------------------------------------------
+
+def test_export_opens_files_lazily_and_closes(archive):
+    with Export(archive) as export:
+        assert "Portfolio.html" in export
+        with export.open("site_files/img_0_0.jpg") as f:
+            with Image.open(f) as img:
+                assert img.size == (320, 240)
+        with pytest.raises(KeyError):
+            export.open("missing.jpg")
+    assert export._zip.fp is None
+
+
+@pytest.mark.parametrize("render", [render_images, render_tiles])
+def test_sources_render_the_same_sheet(render, archive, portfolio,
+                                       placeholder):
+    sheets = [render(source, placeholder, as_image=True)
+              for source in (archive, portfolio, io.BytesIO(archive))]
+    for sheet in sheets[1:]:
+        assert ImageChops.difference(sheets[0], sheet).getbbox() is None
+
+
+@pytest.mark.skipif(shutil.which("pdfinfo") is None,
+                    reason="poppler is not installed")
+def test_render_pdfs_inserts_placeholder(placeholder):
+    sheet = render_pdfs([b"%PDF-1.4 corrupt"], placeholder, as_image=True)
+    assert sheet.size == (64, 48)
+
+
+def test_pdf_bytes_hit_the_disk_once(monkeypatch):
+    paths = []
+
+    def pdfinfo(path, timeout=None):
+        paths.append(path)
+        return {"Pages": 1, "Page size": "72 x 36 pts"}
+
+    def convert(path, **kwargs):
+        paths.append(path)
+        with open(path, "rb") as f:
+            assert f.read() == b"%PDF-1.4"
+        return [Image.new("RGB", (200, 100), "red")]
+
+    monkeypatch.setattr(pdf2image, "pdfinfo_from_path", pdfinfo)
+    monkeypatch.setattr(pdf2image, "convert_from_path", convert)
+    sheet = render_pdfs([b"%PDF-1.4"], as_image=True)
+    assert sheet.size == (200, 100)
+    # pdfinfo and the conversion share one temporary file, removed after
+    assert len(paths) == 2 and paths[0] == paths[1]
+    assert not os.path.exists(paths[0])
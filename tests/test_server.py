@@ -0,0 +1,109 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+from concurrent.futures import ThreadPoolExecutor
+import http.client
+import os
+import threading
+import time
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+import pytest
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet import server
+
+
+# FIXTURES --------------------------------------------------------------------
+
+@pytest.fixture
+def running(portfolio, placeholder):
+    httpd = server.make_server(os.path.dirname(portfolio), placeholder,
+                               port=0, decode_timeout=None)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def _get(httpd, url, headers=None):
+    conn = http.client.HTTPConnection(*httpd.server_address[:2], timeout=60)
+    try:
+        conn.request("GET", url, headers=headers or {})
+        response = conn.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        conn.close()
+
+
+def _count_builds(service, delay=0.0):
+    builds = []
+    build = service.build
+
+    def counting(*args):
+        builds.append(args)
+        time.sleep(delay)
+        return build(*args)
+
+    service.build = counting
+    return builds
+
+
+# TESTS -----------------------------------------------------------------------
+
+def test_concurrent_requests_share_one_build(running):
+    builds = _count_builds(running.RequestHandlerClass.service, delay=0.3)
+    url = "/sheet?kind=images&path=portfolio&wm=5&hm=5"
+    with ThreadPoolExecutor(8) as executor:
+        results = list(executor.map(lambda _: _get(running, url), range(8)))
+    assert len(builds) == 1
+    assert {status for status, _, _ in results} == {200}
+    assert len({body for _, _, body in results}) == 1
+
+
+def test_cache_hit_and_etag(running):
+    builds = _count_builds(running.RequestHandlerClass.service)
+    url = "/sheet?kind=tiles&path=portfolio"
+    status, headers, body = _get(running, url)
+    assert status == 200
+    assert body[:2] == b"\xff\xd8"
+    assert int(headers["Content-Length"]) == len(body)
+    status, _, cached = _get(running, url)
+    assert (status, cached) == (200, body)
+    status, _, empty = _get(running, url,
+                            headers={"If-None-Match": headers["ETag"]})
+    assert (status, empty) == (304, b"")
+    assert len(builds) == 1
+    # other parameters are a different sheet
+    _get(running, url + "&background=black")
+    assert len(builds) == 2
+
+
+def test_rejects_invalid_requests(running):
+    assert _get(running, "/sheet?path=../..")[0] == 403
+    assert _get(running, "/sheet?path=portfolio/../../..")[0] == 403
+    assert _get(running, "/sheet?path=missing")[0] == 404
+    assert _get(running, "/sheet?path=portfolio&kind=nope")[0] == 400
+    assert _get(running, "/sheet?path=portfolio&wm=x")[0] == 400
+    assert _get(running, "/sheet?path=portfolio&background=nocolor")[0] == 400
+    for value in ("nan", "inf", "-inf"):
+        for name in ("factor", "mpmax"):
+            url = "/sheet?path=portfolio&{0}={1}".format(name, value)
+            assert _get(running, url)[0] == 400
+
+
+def test_parameters_are_clamped():
+    params = server.parse_params({"factor": ["50"], "mpmax": ["100000"],
+                                  "wm": ["-3"], "hm": ["9999"]})
+    assert params == {"factor": 4.0, "mpmax": 50.0, "wm": 0, "hm": 100}
+
+
+def test_cache_is_limited_by_bytes(portfolio, placeholder):
+    service = server.SheetService(os.path.dirname(portfolio), placeholder,
+                                  cache_bytes=1, decode_timeout=None)
+    service.get("tiles", "portfolio", {})
+    assert len(service._cache) == 0
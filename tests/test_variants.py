@@ -0,0 +1,94 @@
+# PYTHON STANDARD LIBRARY IMPORTS ---------------------------------------------
+
+import io
+import math
+import os
+
+
+# THIRD PARTY MODULE IMPORTS --------------------------------------------------
+
+from PIL import Image
+import pytest
+
+
+# LOCAL MODULE IMPORTS --------------------------------------------------------
+
+from moodlesheet import (extract_images,
+                         extract_tiles,
+                         render_images,
+                         render_tiles)
+from moodlesheet import extract, guard
+
+
+# FIXTURES --------------------------------------------------------------------
+
+@pytest.fixture
+def decodes(monkeypatch):
+    """Counts the images decoded in and outside of worker processes."""
+    calls = []
+
+    def counting(fit_image):
+        def fit(image, bounds):
+            calls.append(bounds)
+            return fit_image(image, bounds)
+        return fit
+
+    monkeypatch.setattr(extract, "fit_image", counting(extract.fit_image))
+    monkeypatch.setattr(guard, "fit_image", counting(guard.fit_image))
+    return calls
+
+
+def _maxdim(mpmax):
+    return math.floor(math.sqrt(mpmax * 1000000))
+
+
+# TESTS -----------------------------------------------------------------------
+
+@pytest.mark.parametrize("extractor, images", [(extract_images, 4),
+                                               (extract_tiles, 3)])
+def test_extract_variants(extractor, images, portfolio, placeholder, tmp_path,
+                          decodes):
+    outputfile = str(tmp_path / "sheet.jpg")
+    variants = [{"outputfile": str(tmp_path / "sheet_thumb.webp"),
+                 "mpmax": 0.02},
+                {"outputfile": str(tmp_path / "sheet_web.png"),
+                 "mpmax": 0.1},
+                {"outputfile": str(tmp_path / "sheet_small.jpg"),
+                 "max_bytes": 4096}]
+    result = extractor(portfolio, outputfile, placeholder, variants=variants)
+    assert result == [outputfile] + [v["outputfile"] for v in variants]
+    # every image is decoded once, for the sheet and all variants
+    assert len(decodes) == images
+    with Image.open(outputfile) as sheet:
+        assert sheet.format == "JPEG"
+        size = sheet.size
+    for variant, fmt in zip(variants, ["WEBP", "PNG", "JPEG"]):
+        with Image.open(variant["outputfile"]) as image:
+            assert image.format == fmt
+            if "mpmax" in variant:
+                assert max(image.size) == min(max(size),
+                                              _maxdim(variant["mpmax"]))
+    assert os.path.getsize(variants[2]["outputfile"]) <= 4096
+
+
+@pytest.mark.parametrize("renderer, images", [(render_images, 4),
+                                              (render_tiles, 3)])
+def test_render_variants(renderer, images, portfolio, placeholder, decodes):
+    variants = [{"mpmax": 0.02, "fmt": "WEBP", "quality": 80},
+                {"mpmax": 0.1, "fmt": "PNG"},
+                {"max_bytes": 4096}]
+    result = renderer(portfolio, placeholder, variants=variants)
+    assert len(result) == 1 + len(variants)
+    assert len(decodes) == images
+    sheets = [Image.open(io.BytesIO(data)) for data in result]
+    assert [s.format for s in sheets] == ["JPEG", "WEBP", "PNG", "JPEG"]
+    for variant, sheet in zip(variants, sheets[1:]):
+        if "mpmax" in variant:
+            assert max(sheet.size) == min(max(sheets[0].size),
+                                          _maxdim(variant["mpmax"]))
+    assert len(result[3]) <= 4096
+    # as images, the variants come back in the given order as well
+    images = renderer(portfolio, placeholder, variants=variants,
+                      as_image=True)
+    assert [max(i.size) for i in images[1:3]] == [_maxdim(0.02),
+                                                  _maxdim(0.1)]